@@ -1,68 +1,188 @@
 import os
-import re
 import json
+import time
+import random
+import wave
+import asyncio
 import tempfile
-from typing import List, Dict, Any, Optional
-
+import subprocess
+from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+import httpx
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, APIConnectionError, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from .models import Lecture, Question
-
-# 音訊處理（需 ffmpeg；你的 apt.txt 已含 ffmpeg）
-from pydub import AudioSegment
+from .semantic_cache import semantic_cached
 
 load_dotenv()  # 本地讀 .env；Render 讀 Environment
 
+_SENTENCE_ENDS = str.maketrans("！？", "。。")
+
 
 # =========================
 # OpenAI Client
 # =========================
-def create_openai_client() -> OpenAI:
+def _openai_credentials() -> Dict[str, str]:
     api_key = os.getenv("OPENAI_API_KEY") or getattr(settings, "OPENAI_API_KEY", None)
     api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
     if not api_key or api_key.strip().upper() == "EMPTY":
         raise ValueError("❌ 請設定 OPENAI_API_KEY（Render → Environment 或本地 .env）")
-    return OpenAI(api_key=api_key, base_url=api_base)
+    return {"api_key": api_key, "base_url": api_base}
+
+
+@lru_cache(maxsize=1)
+def create_openai_client() -> OpenAI:
+    """
+    每個行程共用一個 client，讓連線池（HTTP/2、TLS session）跨講次重複使用。
+    """
+    return OpenAI(
+        **_openai_credentials(),
+        http_client=DefaultHttpxClient(http2=True, limits=httpx.Limits(max_connections=32))
+    )
+
+
+def create_async_openai_client() -> AsyncOpenAI:
+    # 不快取：AsyncClient 綁定建立時的事件迴圈，而每次 asyncio.run 都是新的迴圈
+    return AsyncOpenAI(**_openai_credentials())
 
 
 # =========================
 # 長音檔：轉格式 + 切片（8 分鐘一段）
 # =========================
+SAMPLE_RATE = 16000   # Whisper 建議 16kHz
+SAMPLE_WIDTH = 2      # s16le
+
+
 def _prepare_audio_chunks(src_path: str,
                           chunk_ms: int = 8 * 60 * 1000,
-                          overlap_ms: int = 2000) -> List[str]:
+                          overlap_ms: int = 2000) -> Iterator[Tuple[int, BytesIO]]:
     """
-    將任意長度音檔轉為 16kHz mono wav，切段，回傳臨時檔路徑清單。
+    以單一 ffmpeg 子行程將任意長度音檔解碼為 16kHz mono s16le PCM，
+    邊讀邊切段，逐段產出 (序號, 記憶體中的 wav 檔)；不落地任何臨時檔。
     需系統有 ffmpeg（由 apt.txt 安裝）。
     """
     if not os.path.exists(src_path):
         raise FileNotFoundError(f"找不到音檔：{src_path}")
 
-    audio = AudioSegment.from_file(src_path)
-    audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    bytes_per_ms = SAMPLE_RATE * SAMPLE_WIDTH // 1000
+    chunk_bytes = chunk_ms * bytes_per_ms
+    overlap_bytes = overlap_ms * bytes_per_ms
 
-    paths: List[str] = []
-    duration = len(audio)
-    start = 0
+    # stderr 寫到臨時檔而非 PIPE：損壞檔案可能輸出大量錯誤訊息，未讀取的 PIPE 塞滿會讓 ffmpeg 與本程序互相卡死
+    err_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", src_path,
+         "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE,
+        stderr=err_file,
+    )
+
+    tail = b""
     idx = 0
+    try:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            bio = BytesIO()
+            with wave.open(bio, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(SAMPLE_WIDTH)
+                wav.setframerate(SAMPLE_RATE)
+                # 直接分兩次寫入，不另外串接出一份 tail + data 的整段複本
+                wav.writeframesraw(tail)
+                wav.writeframes(data)
+            bio.seek(0)
+            bio.name = f"chunk{idx}.wav"   # SDK 依副檔名判斷格式
+            yield idx, bio
+            # 只保留 overlap_ms 長度的 PCM 供下一段開頭使用，工作集與音檔總長無關
+            if not overlap_bytes:
+                tail = b""
+            elif len(data) >= overlap_bytes:
+                tail = data[-overlap_bytes:]
+            else:
+                tail = (tail + data)[-overlap_bytes:]
+            idx += 1
+        proc.stdout.close()
+        if proc.wait() != 0:
+            err_file.seek(0)
+            stderr = err_file.read().decode("utf-8", "replace").strip()
+            raise RuntimeError(f"ffmpeg 轉檔失敗：{stderr[-2000:]}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        err_file.close()
+
+
+async def _transcribe_chunks_async(client: AsyncOpenAI, audio_path: str,
+                                   concurrency: int = 4) -> Dict[int, str]:
+    """
+    邊切段邊送出 whisper-1 請求，最多 concurrency 段同時進行。
+    取得 Semaphore 後才讀下一段，記憶體中最多只保留 concurrency 段音訊。
+    """
+    sem = asyncio.Semaphore(concurrency)
+    chunks = _prepare_audio_chunks(audio_path)
 
-    while start < duration:
-        end = min(start + chunk_ms, duration)
-        segment = audio[max(0, start - overlap_ms):end]
-        fd, tmp_path = tempfile.mkstemp(suffix=f".chunk{idx}.wav")
-        os.close(fd)
-        segment.export(tmp_path, format="wav")
-        paths.append(tmp_path)
-        start = end
-        idx += 1
+    async def _one(i: int, bio: BytesIO) -> Tuple[int, str]:
+        try:
+            resp = await client.audio.transcriptions.create(
+                model="whisper-1",
+                file=bio
+            )
+            text = getattr(resp, "text", None) or (resp if isinstance(resp, str) else "")
+            print(f"  └─ 分段 {i+1} 完成，長度：{len(text)}")
+            return i, text or ""
+        finally:
+            bio.close()
+            sem.release()
+
+    tasks: List[asyncio.Task] = []
+
+    def _raise_if_failed() -> None:
+        # 任一段失敗即停止派送，避免繼續解碼、上傳（並付費）剩餘段落
+        for t in tasks:
+            if t.done() and not t.cancelled() and t.exception() is not None:
+                raise t.exception()
 
-    return paths
+    try:
+        while True:
+            await sem.acquire()
+            try:
+                _raise_if_failed()
+            except BaseException:
+                sem.release()
+                raise
+            # ffmpeg 讀取為阻塞 I/O，交給執行緒避免卡住事件迴圈
+            item = await asyncio.to_thread(next, chunks, None)
+            if item is None:
+                sem.release()
+                break
+            tasks.append(asyncio.create_task(_one(*item)))
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            chunks.close()
+        except Exception:
+            pass
+        raise
+    return dict(results)
 
 
-def transcribe_with_whisper(audio_path: str) -> Optional[str]:
+async def transcribe_with_whisper_async(audio_path: str, concurrency: int = 4) -> Optional[str]:
     """
-    針對長音檔：先切片後逐段用 whisper-1 轉錄，最後合併。
+    針對長音檔：先切片後併發用 whisper-1 轉錄，最後依原順序合併。
     """
     try:
         if not os.path.exists(audio_path):
@@ -70,27 +190,10 @@ def transcribe_with_whisper(audio_path: str) -> Optional[str]:
             return None
 
         print("✅ Whisper API 轉錄開始（長音檔自動分段）")
-        client = create_openai_client()
-        chunk_paths = _prepare_audio_chunks(audio_path)
+        async with create_async_openai_client() as client:
+            pieces = await _transcribe_chunks_async(client, audio_path, concurrency)
 
-        pieces: List[str] = []
-        for i, cpath in enumerate(chunk_paths):
-            try:
-                with open(cpath, "rb") as f:
-                    resp = client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=f
-                    )
-                text = getattr(resp, "text", None) or (resp if isinstance(resp, str) else "")
-                print(f"  └─ 分段 {i+1}/{len(chunk_paths)} 完成，長度：{len(text)}")
-                pieces.append((text or "").strip())
-            finally:
-                try:
-                    os.remove(cpath)
-                except Exception:
-                    pass
-
-        full_text = "\n".join(t for t in pieces if t)
+        full_text = "\n".join(p for p in (pieces[i] for i in sorted(pieces)) if p)
         return full_text.strip() or None
 
     except Exception as e:
@@ -98,65 +201,245 @@ def transcribe_with_whisper(audio_path: str) -> Optional[str]:
         return None
 
 
+def transcribe_with_whisper(audio_path: str) -> Optional[str]:
+    return asyncio.run(transcribe_with_whisper_async(audio_path))
+
+
 # =========================
 # 文本分段（避免 prompt 過長）
 # =========================
+def _split_sentences(text: str) -> List[str]:
+    """
+    在「。！？」之後切句並去掉緊接的空白，結果同 re.split(r'(?<=[。！？])\s*', text)（不含空字串）。
+    先把三種句尾統一成「。」再用 str.split 一次切完，掃描全在 C 層完成。
+    """
+    sentences: List[str] = []
+    pos = 0
+    for piece in text.translate(_SENTENCE_ENDS).split("。"):
+        end = pos + len(piece) + 1
+        sentence = text[pos:end] if pos == 0 else text[pos:end].lstrip()
+        if sentence:
+            sentences.append(sentence)
+        pos = end
+    return sentences
+
+
 def dynamic_split(text: str, min_length: int = 300, max_length: int = 1000) -> List[str]:
     text = text.strip()
     if len(text) <= max_length:
         return [text]
-    paragraphs = re.split(r'(?<=[。！？])\s*', text)
-    chunks, temp = [], ""
+    paragraphs = _split_sentences(text)
+    if len(paragraphs) <= 1:
+        # 整段沒有句尾標點（如未斷句的逐字稿），切不開，直接回傳
+        return [text]
+    chunks: List[str] = []
+    buf: List[str] = []
+    buf_len = 0
     for para in paragraphs:
-        if len(temp) + len(para) <= max_length:
-            temp += para
+        if buf_len + len(para) <= max_length:
+            buf.append(para)
+            buf_len += len(para)
         else:
-            if len(temp) >= min_length:
-                chunks.append(temp.strip())
-                temp = para
+            if buf_len >= min_length:
+                chunks.append("".join(buf).strip())
+                buf, buf_len = [para], len(para)
             else:
-                temp += para
-    if temp:
-        chunks.append(temp.strip())
+                buf.append(para)
+                buf_len += len(para)
+    if buf_len:
+        chunks.append("".join(buf).strip())
     return chunks
 
 
 # =========================
 # 摘要（分段 + 總結）
 # =========================
-def generate_summary_for_chunk(client: OpenAI, chunk: str, chunk_index: int, total_chunks: int) -> str:
-    messages = [
-        {"role": "system", "content": f"""你是一位專業的繁體中文課程摘要設計師。
-請針對第 {chunk_index + 1} 段課程內容進行重點摘要，包含：
+SUMMARY_SYSTEM_PROMPT = """你是一位專業的繁體中文課程摘要設計師。
+請針對使用者提供的該段課程內容進行重點摘要，包含：
 - 簡潔內容概述（50–80字）
 - 2–4 個學習要點，使用條列式
-總字數控制在 150 字內。"""},
-        {"role": "user", "content": chunk}
+總字數控制在 150 字內。"""
+
+
+def _summary_messages(chunk: str, chunk_index: int, total_chunks: int) -> List[Dict[str, str]]:
+    # system prompt 固定不變、段落序號放在 user 訊息，讓各段請求前綴一致。
+    # 註：OpenAI prompt caching 需 ≥1024 tokens 的相同前綴，目前 system prompt 僅約 100 tokens，
+    # 實際不會命中快取；若日後加長（例如加入範例）才會受益。
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"[第 {chunk_index + 1}/{total_chunks} 段]\n{chunk}"}
     ]
+
+
+# 段落序號只影響提示，不影響摘要內容，故不納入快取鍵
+@semantic_cached(namespace="summary", threshold=0.92, ignore=("chunk_index", "total_chunks", "max_attempts"))
+async def _summarize_chunk_async(client: AsyncOpenAI, chunk: str, chunk_index: int, total_chunks: int,
+                                 max_attempts: int = 5) -> Optional[str]:
+    """
+    段落摘要；遇到 RateLimitError 以指數退避（含抖動）重試，失敗回傳 None。
+    """
+    messages = _summary_messages(chunk, chunk_index, total_chunks)
+    # 關閉 SDK 內建重試（預設 2 次），只保留下方的退避迴圈
+    no_retry_client = client.with_options(max_retries=0)
+    delay = 1.0
+    for attempt in range(1, max_attempts + 1):
+        try:
+            resp = await no_retry_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.3,
+                max_tokens=400
+            )
+            return resp.choices[0].message.content.strip()
+        except RateLimitError as e:
+            if attempt == max_attempts:
+                print(f"❌ 段落摘要錯誤（超過重試上限）: {e}")
+                break
+            wait = delay * (1 + random.random())
+            print(f"⏳ 第 {chunk_index + 1} 段遇到速率限制，{wait:.1f} 秒後重試（{attempt}/{max_attempts}）")
+            await asyncio.sleep(wait)
+            delay *= 2
+        except Exception as e:
+            print(f"❌ 段落摘要錯誤: {e}")
+            break
+    return None
+
+
+async def _gather_with_sem(client: AsyncOpenAI, chunks: List[str], sem_limit: int = 8) -> List[str]:
+    """
+    同時送出所有段落摘要請求，以 Semaphore 限制併發數量（避免超過 RPM/TPM）。
+    回傳順序與 chunks 相同。
+    """
+    sem = asyncio.Semaphore(sem_limit)
+    total = len(chunks)
+
+    async def _one(chunk: str, i: int) -> str:
+        async with sem:
+            return await _summarize_chunk_async(client, chunk, i, total) or f"第 {i + 1} 段摘要失敗"
+
+    async with client:
+        return await asyncio.gather(*[_one(c, i) for i, c in enumerate(chunks)])
+
+
+def summarize_chunks(chunks: List[str], sem_limit: int = 8) -> List[str]:
+    return asyncio.run(_gather_with_sem(create_async_openai_client(), chunks, sem_limit=sem_limit))
+
+
+# =========================
+# Batch API（非即時批次處理：費用減半、獨立速率限制）
+# =========================
+def submit_batch(client: OpenAI, requests: List[Dict[str, Any]],
+                 poll_interval: int = 30, max_wait: int = 600) -> Dict[str, Optional[str]]:
+    """
+    將多個 chat completion 請求（每筆需含 custom_id 與 body）寫成 JSONL 送交 Batch API，
+    輪詢至完成後回傳 {custom_id: 回應文字}；失敗的請求對應 None。
+    超過 max_wait 秒仍未完成即取消該 batch，全部回傳 None。
+    ⚠️ 此函式會同步阻塞直到完成或逾時，只能在離線工作（如 manage.py 指令、排程）中呼叫，
+    絕不可在 Django request thread 中使用。
+    """
+    fd, jsonl_path = tempfile.mkstemp(suffix=".batch.jsonl")
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",   # 較快、較不易超時
-            messages=messages,
-            temperature=0.3,
-            max_tokens=400
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"❌ 段落摘要錯誤: {e}")
-        return f"第 {chunk_index + 1} 段摘要失敗"
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for req in requests:
+                f.write(json.dumps({
+                    "custom_id": req["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": req["body"],
+                }, ensure_ascii=False) + "\n")
+        with open(jsonl_path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+    finally:
+        try:
+            os.remove(jsonl_path)
+        except Exception:
+            pass
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"📦 Batch 已送出：{batch.id}（共 {len(requests)} 筆）")
+
+    results: Dict[str, Optional[str]] = {req["custom_id"]: None for req in requests}
+    deadline = time.monotonic() + max_wait
+    while batch.status not in {"completed", "failed", "expired", "cancelled"}:
+        if time.monotonic() >= deadline:
+            print(f"⏰ Batch {batch.id} 超過 {max_wait} 秒未完成，取消")
+            try:
+                client.batches.cancel(batch.id)
+            except Exception as e:
+                print(f"⚠️ 取消 Batch 失敗：{e}")
+            return results
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                row = orjson.loads(line)
+                print(f"⚠️ Batch 請求 {row.get('custom_id')} 失敗：{row.get('error') or row.get('response')}")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"❌ Batch 未完成：{batch.status}")
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        row = orjson.loads(line)
+        resp = row.get("response") or {}
+        if resp.get("status_code") != 200:
+            print(f"⚠️ Batch 請求 {row.get('custom_id')} 失敗：{row.get('error')}")
+            continue
+        try:
+            content = resp["body"]["choices"][0]["message"]["content"]
+            results[row["custom_id"]] = (content or "").strip()
+        except (KeyError, IndexError, TypeError):
+            continue
+    return results
 
 
-def combine_summaries(client: OpenAI, summaries: List[str]) -> str:
-    combined = "\n\n".join([f"段落 {i+1}：{s}" for i, s in enumerate(summaries)])
-    messages = [
-        {"role": "system", "content": """你是教育設計專家，請將下列分段摘要統整為完整課程摘要，格式如下：
+def summarize_chunks_batch(client: OpenAI, chunks: List[str]) -> List[str]:
+    requests = [{
+        "custom_id": f"summary-{i}",
+        "body": {
+            "model": "gpt-4o-mini",
+            "messages": _summary_messages(c, i, len(chunks)),
+            "temperature": 0.3,
+            "max_tokens": 400,
+        },
+    } for i, c in enumerate(chunks)]
+    results = submit_batch(client, requests)
+    summaries = [results.get(f"summary-{i}") for i in range(len(chunks))]
+
+    # 失敗或逾時的段落改走即時併發摘要
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if missing:
+        print(f"🔁 {len(missing)} 段未取得 Batch 結果，改用即時摘要")
+        for i, summary in zip(missing, summarize_chunks([chunks[i] for i in missing])):
+            summaries[i] = summary
+    return summaries
+
+
+COMBINE_SYSTEM_PROMPT = """你是教育設計專家，請將下列分段摘要統整為完整課程摘要，格式如下：
 
 【課程概述】：說明整體課程內容與重要性（150–200字）
 【學習重點】：列出本課程的 4–5 個學習目標（條列）
 【完成後收穫】：簡述學生完成課程後能具備的能力（60字內）
 
-請使用繁體中文，避免重複敘述，控制總字數在 400 字內。"""},
-        {"role": "user", "content": combined}
+請使用繁體中文，避免重複敘述，控制總字數在 400 字內。"""
+
+
+def _format_chunk_summaries(summaries: List[str]) -> str:
+    return "\n\n".join([f"段落 {i+1}：{s}" for i, s in enumerate(summaries)])
+
+
+def combine_summaries(client: OpenAI, summaries: List[str]) -> str:
+    messages = [
+        {"role": "system", "content": COMBINE_SYSTEM_PROMPT},
+        {"role": "user", "content": _format_chunk_summaries(summaries)}
     ]
     try:
         resp = client.chat.completions.create(
@@ -174,6 +457,9 @@ def combine_summaries(client: OpenAI, summaries: List[str]) -> str:
 # =========================
 # 出題（選擇題 + 是非題）
 # =========================
+MCQ_OPTION_KEYS = ("A", "B", "C", "D")
+
+
 def normalize_mcq_payload(data: Any) -> List[Dict[str, Any]]:
     if isinstance(data, dict) and "items" in data and isinstance(data["items"], list):
         items = data["items"]
@@ -182,95 +468,109 @@ def normalize_mcq_payload(data: Any) -> List[Dict[str, Any]]:
     else:
         raise ValueError("JSON 結構不符合預期")
 
+    # 以一次走訪完成驗證與轉換，不再為每題建立 try/except 例外處理路徑
     cleaned: List[Dict[str, Any]] = []
     for it in items:
-        try:
-            concept = str(it["concept"]).strip()
-            question = str(it["question"]).strip()
-            options = it["options"]
-            answer = str(it["answer"]).strip().upper()
-            explanation = str(it.get("explanation", "")).strip()
-            if not isinstance(options, dict):
-                continue
-            if not all(k in options for k in ["A", "B", "C", "D"]):
-                continue
-            if answer not in {"A", "B", "C", "D"}:
-                continue
-            cleaned.append({
-                "concept": concept,
-                "question": question,
-                "options": {
-                    "A": str(options["A"]),
-                    "B": str(options["B"]),
-                    "C": str(options["C"]),
-                    "D": str(options["D"]),
-                },
-                "answer": answer,
-                "explanation": explanation,
-            })
-        except Exception:
+        if not isinstance(it, dict) or "concept" not in it or "question" not in it or "answer" not in it:
+            continue
+        options = it.get("options")
+        if not isinstance(options, dict) or not all(k in options for k in MCQ_OPTION_KEYS):
             continue
+        answer = str(it["answer"]).strip().upper()
+        if answer not in MCQ_OPTION_KEYS:
+            continue
+        cleaned.append({
+            "concept": str(it["concept"]).strip(),
+            "question": str(it["question"]).strip(),
+            "options": {k: str(options[k]) for k in MCQ_OPTION_KEYS},
+            "answer": answer,
+            "explanation": str(it.get("explanation", "")).strip(),
+        })
     return cleaned
 
 
 def safe_json_parse(raw: str) -> List[Dict[str, Any]]:
+    # 所有出題呼叫皆使用 JSON mode，不再需要 ```json / 彎引號 / 尾逗號的修補
     try:
-        return normalize_mcq_payload(json.loads(raw))
-    except Exception:
-        pass
-    m = re.search(r'```json\s*([\s\S]*?)```', raw, re.IGNORECASE)
-    if not m:
-        m = re.search(r'(\{[\s\S]*\}|\[[\s\S]*\])', raw)
-    if m:
-        candidate = m.group(1)
-        candidate = candidate.replace("“", '"').replace("”", '"').replace("’", "'")
-        candidate = re.sub(r",\s*([\]}])", r"\1", candidate)
-        try:
-            return normalize_mcq_payload(json.loads(candidate))
-        except Exception as e:
-            print("❌ JSON 區塊解析仍失敗：", e)
-    print("⚠️ MCQ 原始回應（截斷 500 字）：", raw[:500])
-    raise ValueError("模型未回傳合法 JSON")
+        return normalize_mcq_payload(orjson.loads(raw))
+    except Exception as e:
+        print("⚠️ MCQ 原始回應（截斷 500 字）：", raw[:500])
+        raise ValueError(f"模型未回傳合法 JSON：{e}")
 
 
+def _stream_json(client: OpenAI, **kwargs: Any) -> str:
+    """
+    以 stream=True 呼叫 chat completion，邊收邊追蹤最外層 JSON 的括號深度（忽略字串內字元）；
+    最外層陣列／物件一閉合就關閉串流，不再等待（或付費）後續 token。
+    回傳從第一個 { 或 [ 起的內容；若從未出現 JSON，回傳完整原文。
+    """
+    stream = client.chat.completions.create(stream=True, **kwargs)
+    buf: List[str] = []
+    offset = 0
+    start: Optional[int] = None
+    depth = 0
+    in_string = escaped = False
+    try:
+        for event in stream:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content or ""
+            buf.append(delta)
+            for i, ch in enumerate(delta):
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = start is not None
+                elif ch in "{[":
+                    if start is None:
+                        start = offset + i
+                    depth += 1
+                elif ch in "}]" and start is not None:
+                    depth -= 1
+                    if depth == 0:
+                        return "".join(buf)[start:offset + i + 1]
+            offset += len(delta)
+    finally:
+        stream.close()
+    return "".join(buf)
+
+
+# 只重試暫時性錯誤（429／5xx／連線問題），以隨機指數退避讓伺服器恢復；格式錯誤由 JSON mode 處理
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(min=1, max=20),
+    retry=retry_if_exception_type((RateLimitError, InternalServerError, APIConnectionError)),
+    reraise=True,
+)
+def _call_json(client: OpenAI, messages: List[Dict[str, str]], **params: Any) -> str:
+    # 關閉 SDK 內建重試（預設 2 次），由 tenacity 單獨控制，避免重試次數與退避時間相乘
+    return _stream_json(
+        client.with_options(max_retries=0),
+        model="gpt-4o-mini",
+        messages=messages,
+        response_format={"type": "json_object"},
+        **params
+    )
+
+
+@semantic_cached(namespace="mcq", threshold=0.92)
 def generate_quiz_with_retry(client: OpenAI, summary: str, count: int = 3) -> List[Dict[str, Any]]:
     system = f"""你是一位課程出題 AI，請根據以下課程摘要產生 {count} 題選擇題。
-嚴格且只輸出 JSON「陣列」，不要任何說明、不要加 ```json。每一題物件必須包含：
+只輸出 JSON 物件 {{"items": [...]}}，items 中每一題物件必須包含：
 concept, question, options(A/B/C/D), answer(只能是 A/B/C/D), explanation。"""
     messages = [
         {"role": "system", "content": system},
         {"role": "user", "content": summary}
     ]
-    # 嘗試 1
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1500
-        )
-        raw = resp.choices[0].message.content or ""
-        return safe_json_parse(raw)
-    except Exception as e:
-        print("🔁 第一次解析失敗，改用更嚴格提示重試：", e)
-
-    # 嘗試 2（更嚴格）
-    hard_prompt = summary + f"\n\n請嚴格輸出 {count} 題選擇題，只輸出 JSON 陣列，格式嚴謹。不要有任何說明、```json、前後文字。"
-    try:
-        messages = [
-            {"role": "system", "content": "你只會輸出 JSON。"},
-            {"role": "user", "content": hard_prompt}
-        ]
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=1500
-        )
-        raw = resp.choices[0].message.content or ""
-        return safe_json_parse(raw)
+        return safe_json_parse(_call_json(client, messages, temperature=0.2, max_tokens=1500))
     except Exception as e:
-        print("❌ 重試仍失敗：", e)
+        print("❌ 選擇題產生失敗：", e)
         return []
 
 
@@ -279,16 +579,18 @@ def generate_tf_questions(client: OpenAI, summary: str, count: int) -> List[Dict
         {
             "role": "system",
             "content": f"""請根據以下課程摘要，設計 {count} 題是非題（True/False），格式如下：
-[
-  {{
-    "concept": "學習概念",
-    "question": "問題內容",
-    "answer": "True",
-    "explanation": "正確答案解析"
-  }},
-  ...
-]
-請回傳 JSON 格式資料，不要有其他文字說明。"""
+{{
+  "items": [
+    {{
+      "concept": "學習概念",
+      "question": "問題內容",
+      "answer": "True",
+      "explanation": "正確答案解析"
+    }},
+    ...
+  ]
+}}
+請回傳 JSON 物件，不要有其他文字說明。"""
         },
         {"role": "user", "content": summary}
     ]
@@ -297,25 +599,143 @@ def generate_tf_questions(client: OpenAI, summary: str, count: int) -> List[Dict
             model="gpt-4o-mini",
             messages=messages,
             temperature=0.3,
-            max_tokens=1200
+            max_tokens=1200,
+            response_format={"type": "json_object"}
         )
-        return json.loads(resp.choices[0].message.content)
+        data = orjson.loads(resp.choices[0].message.content or "")
+        items = data.get("items") if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("JSON 結構不符合預期")
+        return items
     except Exception as e:
         print(f"❌ 是非題產生失敗：{e}")
         return []
 
 
+# =========================
+# 合併呼叫：總結 + 選擇題 + 是非題（json_schema 結構化輸出）
+# =========================
+COURSE_PACKAGE_SCHEMA: Dict[str, Any] = {
+    "name": "course_package",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["summary", "mcq", "tf"],
+        "properties": {
+            "summary": {"type": "string"},
+            "mcq": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["concept", "question", "options", "answer", "explanation"],
+                    "properties": {
+                        "concept": {"type": "string"},
+                        "question": {"type": "string"},
+                        "options": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": ["A", "B", "C", "D"],
+                            "properties": {k: {"type": "string"} for k in ["A", "B", "C", "D"]},
+                        },
+                        "answer": {"type": "string", "enum": ["A", "B", "C", "D"]},
+                        "explanation": {"type": "string"},
+                    },
+                },
+            },
+            "tf": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["concept", "question", "answer", "explanation"],
+                    "properties": {
+                        "concept": {"type": "string"},
+                        "question": {"type": "string"},
+                        "answer": {"type": "string", "enum": ["True", "False"]},
+                        "explanation": {"type": "string"},
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+def generate_all(client: OpenAI, final_summary_chunks: List[str],
+                 num_mcq: int, num_tf: int) -> Optional[Dict[str, Any]]:
+    """
+    單次呼叫同時產生課程摘要、選擇題與是非題，回傳 {summary, mcq, tf}；失敗回傳 None。
+    """
+    return _generate_course_package(client, _format_chunk_summaries(final_summary_chunks), num_mcq, num_tf)
+
+
+# 以合併後的分段摘要與題數為鍵；重複上傳或套版講次可直接沿用整包結果
+@semantic_cached(namespace="course_package", threshold=0.92)
+def _generate_course_package(client: OpenAI, combined: str,
+                             num_mcq: int, num_tf: int) -> Optional[Dict[str, Any]]:
+    system = COMBINE_SYSTEM_PROMPT + f"""
+
+接著根據統整後的課程摘要出題：
+- mcq：{num_mcq} 題選擇題，每題含 concept, question, options(A/B/C/D), answer(只能是 A/B/C/D), explanation
+- tf：{num_tf} 題是非題，每題含 concept, question, answer(True 或 False), explanation
+summary 欄位放完整課程摘要。"""
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": combined}
+    ]
+    try:
+        resp = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0.3,
+            max_tokens=3200,
+            response_format={"type": "json_schema", "json_schema": COURSE_PACKAGE_SCHEMA}
+        )
+        data = orjson.loads(resp.choices[0].message.content or "")
+        summary = str(data["summary"]).strip()
+        if not summary:
+            raise ValueError("summary 為空")
+        return {
+            "summary": summary,
+            "mcq": normalize_mcq_payload(data["mcq"])[:num_mcq],
+            "tf": list(data["tf"])[:num_tf],
+        }
+    except Exception as e:
+        print(f"❌ 合併產生摘要與題目失敗：{e}")
+        return None
+
+
 # =========================
 # 寫入資料庫
 # =========================
+def _validate_question(obj: Question) -> None:
+    """
+    逐題檢查欄位（如 max_length），避免單題超長讓整批 INSERT 失敗（PostgreSQL 會拒絕，SQLite 原本照存）。
+    空白題幹／答案／解析仍允許，與原本 create() 一致，因此只忽略 blank 錯誤。
+    """
+    try:
+        obj.clean_fields(exclude=['lecture'])
+    except ValidationError as e:
+        errors = {
+            field: [err for err in errs if err.code != 'blank']
+            for field, errs in e.error_dict.items()
+        }
+        errors = {field: errs for field, errs in errors.items() if errs}
+        if errors:
+            raise ValidationError(errors)
+
+
 def parse_and_store_questions(summary: str, quiz_data: List[Dict[str, Any]], lecture: Lecture, question_type: str) -> None:
     if not quiz_data:
         return
+    objs: List[Question] = []
     for item in quiz_data:
         try:
             if question_type == 'mcq':
                 options = item.get('options', {}) or {}
-                Question.objects.create(
+                obj = Question(
                     lecture=lecture,
                     question_text=str(item.get('question', '')).strip(),
                     option_a=str(options.get('A', '')).strip(),
@@ -327,57 +747,90 @@ def parse_and_store_questions(summary: str, quiz_data: List[Dict[str, Any]], lec
                     question_type='mcq'
                 )
             elif question_type == 'tf':
-                Question.objects.create(
+                obj = Question(
                     lecture=lecture,
                     question_text=str(item.get('question', '')).strip(),
                     correct_answer=str(item.get('answer', '')).strip(),
                     explanation=str(item.get('explanation', '')).strip(),
                     question_type='tf'
                 )
+            else:
+                continue
+            _validate_question(obj)
+            objs.append(obj)
         except Exception as e:
             print(f"⚠️ 儲存題目失敗：{e}")
 
+    if not objs:
+        return
+    try:
+        with transaction.atomic():
+            Question.objects.bulk_create(objs, batch_size=500)
+    except Exception as e:
+        print(f"⚠️ 儲存題目失敗：{e}")
+
 
 # =========================
 # Pipeline：音檔 → 摘要 → 題庫
 # =========================
-def process_audio_and_generate_quiz(lecture_id: int, num_mcq: int = 3, num_tf: int = 0) -> None:
-    lecture = Lecture.objects.get(id=lecture_id)
-    client = create_openai_client()
-
-    print("🎧 開始語音轉錄")
-    transcript = transcribe_with_whisper(lecture.audio_file.path)
-    if not transcript:
-        print("❌ 轉錄失敗，流程終止")
-        return
-    lecture.transcript = transcript
-    lecture.save()
+def _summarize_and_store(client: OpenAI, lecture: Lecture, summaries: List[str],
+                         num_mcq: int, num_tf: int) -> None:
+    print("🧠 開始產生總結與考題")
+    result = generate_all(client, summaries, num_mcq, num_tf)
+    if result is not None:
+        final_summary = result["summary"]
+        mcq_data, tf_data = result["mcq"], result["tf"]
+    else:
+        # 後備：逐步呼叫（例如 OPENAI_API_BASE 指向不支援 json_schema 的服務）
+        print("🔁 改用逐步產生總結與考題")
+        final_summary = combine_summaries(client, summaries)
+        # 選擇題與是非題互不相依，並行產生（OpenAI client 底層的 httpx.Client 為執行緒安全）
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            fut_m = ex.submit(generate_quiz_with_retry, client, final_summary, num_mcq) if num_mcq > 0 else None
+            fut_t = ex.submit(generate_tf_questions, client, final_summary, num_tf) if num_tf > 0 else None
+            mcq_data = fut_m.result() if fut_m else []
+            tf_data = fut_t.result() if fut_t else []
 
-    print("📝 開始摘要處理")
-    chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
-    final_summary = combine_summaries(client, summaries)
     lecture.summary = final_summary
     lecture.save()
 
-    print("🧠 開始產生考題")
     if num_mcq > 0:
-        mcq_data = generate_quiz_with_retry(client, final_summary, num_mcq)
         if mcq_data:
             parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
         else:
             print("⚠️ 沒有回傳 MCQ 題目")
 
     if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
         if tf_data:
             parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
         else:
             print("⚠️ 沒有回傳 TF 題目")
 
 
+def process_audio_and_generate_quiz(lecture_id: int, num_mcq: int = 3, num_tf: int = 0) -> None:
+    lecture = Lecture.objects.get(id=lecture_id)
+    client = create_openai_client()
+
+    print("🎧 開始語音轉錄")
+    transcript = transcribe_with_whisper(lecture.audio_file.path)
+    if not transcript:
+        print("❌ 轉錄失敗，流程終止")
+        return
+    lecture.transcript = transcript
+    lecture.save()
+
+    print("📝 開始摘要處理")
+    chunks = dynamic_split(transcript)
+    summaries = summarize_chunks(chunks)
+    _summarize_and_store(client, lecture, summaries, num_mcq, num_tf)
+
+
 def process_transcript_and_generate_quiz(lecture: Lecture, client: Optional[OpenAI] = None,
-                                         num_mcq: int = 3, num_tf: int = 0) -> None:
+                                         num_mcq: int = 3, num_tf: int = 0, batch: bool = False) -> None:
+    """
+    batch=True 時，所有段落摘要會合併為單一 Batch API 工作（適合夜間批次等非即時處理）。
+    batch=True 會阻塞至 Batch 完成或逾時（見 submit_batch），不可由 view 呼叫。
+    """
     client = client or create_openai_client()
 
     transcript = lecture.transcript
@@ -387,22 +840,8 @@ def process_transcript_and_generate_quiz(lecture: Lecture, client: Optional[Open
 
     print("📝 開始摘要處理")
     chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
-    final_summary = combine_summaries(client, summaries)
-    lecture.summary = final_summary
-    lecture.save()
-
-    print("🧠 開始產生考題")
-    if num_mcq > 0:
-        mcq_data = generate_quiz_with_retry(client, final_summary, num_mcq)
-        if mcq_data:
-            parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
-        else:
-            print("⚠️ 沒有回傳 MCQ 題目")
-
-    if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
-        if tf_data:
-            parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
-        else:
-            print("⚠️ 沒有回傳 TF 題目")
+    if batch:
+        summaries = summarize_chunks_batch(client, chunks)
+    else:
+        summaries = summarize_chunks(chunks)
+    _summarize_and_store(client, lecture, summaries, num_mcq, num_tf)
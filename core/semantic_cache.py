@@ -0,0 +1,162 @@
+import copy
+import math
+import inspect
+import hashlib
+import operator
+import threading
+from array import array
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# =========================
+# 語意快取（兩層：完全相同 → 雜湊；近似 → embedding 餘弦相似度）
+# =========================
+# 快取存在行程記憶體中（每個 gunicorn worker 各一份），重啟即清空。
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+_lock = threading.Lock()
+
+
+class _NamespaceStore:
+    """單一 namespace 的快取：各自的 LRU 上限；向量以 array('f') 緊密存放（1536 維約 6 KB）。"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.exact: "OrderedDict[str, Any]" = OrderedDict()
+        self.vectors: List[Tuple[str, array, Any]] = []
+
+
+_stores: Dict[str, _NamespaceStore] = {}
+
+
+def _get_store(namespace: str, max_entries: int) -> _NamespaceStore:
+    with _lock:
+        store = _stores.get(namespace)
+        if store is None:
+            store = _stores[namespace] = _NamespaceStore(max_entries)
+        return store
+
+
+def _exact_key(params: str, text: str) -> str:
+    return hashlib.sha256(f"{params}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _normalize(vec: Iterable[float]) -> array:
+    packed = array("f", vec)
+    norm = math.sqrt(sum(map(operator.mul, packed, packed))) or 1.0
+    return array("f", (x / norm for x in packed))
+
+
+def _lookup_exact(store: _NamespaceStore, key: str) -> Tuple[bool, Any]:
+    with _lock:
+        if key in store.exact:
+            store.exact.move_to_end(key)
+            return True, copy.deepcopy(store.exact[key])
+    return False, None
+
+
+def _lookup_semantic(store: _NamespaceStore, params: str, emb: array, threshold: float) -> Tuple[bool, Any]:
+    best_score, best_value = threshold, None
+    with _lock:
+        entries = list(store.vectors)
+    for entry_params, entry_emb, value in entries:
+        if entry_params != params:
+            continue
+        score = sum(map(operator.mul, emb, entry_emb))
+        if score >= best_score:
+            best_score, best_value = score, value
+    if best_value is None:
+        return False, None
+    return True, copy.deepcopy(best_value)
+
+
+def _store(store: _NamespaceStore, key: str, params: str, emb: Optional[array], value: Any) -> None:
+    with _lock:
+        store.exact[key] = copy.deepcopy(value)
+        store.exact.move_to_end(key)
+        while len(store.exact) > store.max_entries:
+            store.exact.popitem(last=False)
+        if emb is not None:
+            store.vectors.append((params, emb, copy.deepcopy(value)))
+            if len(store.vectors) > store.max_entries:
+                del store.vectors[: len(store.vectors) - store.max_entries]
+
+
+def clear_cache() -> None:
+    with _lock:
+        for store in _stores.values():
+            store.exact.clear()
+            store.vectors.clear()
+
+
+def semantic_cached(namespace: str, threshold: float = 0.92, ignore: Tuple[str, ...] = (),
+                    max_entries: int = 512) -> Callable:
+    """
+    快取 LLM 產生函式的結果。被裝飾的函式簽名須為 (client, text, ...)：
+    - 以 text 與其餘參數（ignore 中列出的除外）的雜湊做完全比對，命中則不呼叫 embedding；
+    - 否則計算 text 的 embedding，與同參數的既有快取比對餘弦相似度，>= threshold 視為命中；
+    - 未命中才呼叫模型，並將非空結果寫入快取（None / 空清單不快取，避免記住失敗）。
+    同時支援一般函式與 async 函式（async 版本以 AsyncOpenAI 計算 embedding）。
+    """
+    def decorator(fn: Callable) -> Callable:
+        sig = inspect.signature(fn)
+        store = _get_store(namespace, max_entries)
+
+        def _prepare(args, kwargs) -> Tuple[Any, str, str, str]:
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            names = list(bound.arguments)
+            client, text = bound.arguments[names[0]], bound.arguments[names[1]]
+            params = repr(sorted(
+                (k, v) for k, v in bound.arguments.items()
+                if k not in names[:2] and k not in ignore
+            ))
+            return client, text, params, _exact_key(params, text)
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                client, text, params, key = _prepare(args, kwargs)
+                hit, value = _lookup_exact(store, key)
+                if hit:
+                    return value
+                emb = None
+                try:
+                    resp = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+                    emb = _normalize(resp.data[0].embedding)
+                    hit, value = _lookup_semantic(store, params, emb, threshold)
+                    if hit:
+                        print(f"♻️ 語意快取命中（{namespace}）")
+                        return value
+                except Exception as e:
+                    print(f"⚠️ 語意快取 embedding 失敗，直接呼叫模型：{e}")
+                value = await fn(*args, **kwargs)
+                if value:
+                    _store(store, key, params, emb, value)
+                return value
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            client, text, params, key = _prepare(args, kwargs)
+            hit, value = _lookup_exact(store, key)
+            if hit:
+                return value
+            emb = None
+            try:
+                resp = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+                emb = _normalize(resp.data[0].embedding)
+                hit, value = _lookup_semantic(store, params, emb, threshold)
+                if hit:
+                    print(f"♻️ 語意快取命中（{namespace}）")
+                    return value
+            except Exception as e:
+                print(f"⚠️ 語意快取 embedding 失敗，直接呼叫模型：{e}")
+            value = fn(*args, **kwargs)
+            if value:
+                _store(store, key, params, emb, value)
+            return value
+        return wrapper
+
+    return decorator
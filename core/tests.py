@@ -1,3 +1,270 @@
-from django.test import TestCase
+import asyncio
+import random
+import re
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .ai_modules import (
+    _split_sentences, _stream_json, _transcribe_chunks_async, dynamic_split,
+    parse_and_store_questions, submit_batch,
+)
+from .models import Lecture, Question
+from .semantic_cache import clear_cache, semantic_cached
+
+
+def _reference_split(text, min_length=300, max_length=1000):
+    """原本以 lookbehind regex + 字串串接實作的 dynamic_split，作為比對基準。"""
+    text = text.strip()
+    if len(text) <= max_length:
+        return [text]
+    paragraphs = re.split(r'(?<=[。！？])\s*', text)
+    chunks, temp = [], ""
+    for para in paragraphs:
+        if len(temp) + len(para) <= max_length:
+            temp += para
+        else:
+            if len(temp) >= min_length:
+                chunks.append(temp.strip())
+                temp = para
+            else:
+                temp += para
+    if temp:
+        chunks.append(temp.strip())
+    return chunks
+
+
+def _random_text(rng, max_len):
+    return "".join(rng.choice("ab 課程。！？\n") for _ in range(rng.randint(0, max_len)))
+
+
+class SplitSentencesTests(SimpleTestCase):
+    def test_keeps_punctuation_and_drops_following_whitespace(self):
+        self.assertEqual(_split_sentences("第一句。 第二句！\n第三句？尾巴"),
+                         ["第一句。", "第二句！", "第三句？", "尾巴"])
+
+    def test_matches_regex_split_on_random_input(self):
+        rng = random.Random(0)
+        for _ in range(5000):
+            text = _random_text(rng, 30)
+            expected = [p for p in re.split(r'(?<=[。！？])\s*', text) if p]
+            self.assertEqual(_split_sentences(text), expected, msg=repr(text))
+
+
+class DynamicSplitTests(SimpleTestCase):
+    def test_short_text_is_single_chunk(self):
+        self.assertEqual(dynamic_split("  短文。  "), ["短文。"])
+
+    def test_text_without_sentence_breaks_is_single_chunk(self):
+        text = "無標點" * 500
+        self.assertEqual(dynamic_split(text), [text])
+
+    def test_matches_reference_on_random_input(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            text = _random_text(rng, 400)
+            min_length, max_length = rng.randint(1, 30), rng.randint(20, 80)
+            self.assertEqual(dynamic_split(text, min_length, max_length),
+                             _reference_split(text, min_length, max_length),
+                             msg=repr((text, min_length, max_length)))
+
+
+class _FakeStream:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            self.consumed += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    def close(self):
+        self.closed = True
+
+
+def _fake_client(stream):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream)))
+
+
+class StreamJsonTests(SimpleTestCase):
+    def test_stops_when_top_level_json_closes(self):
+        stream = _FakeStream(['前言 "x" [{"a": "b]', '\\"}"},', ' {"c": [1]}]', "多餘文字", "never"])
+        self.assertEqual(_stream_json(_fake_client(stream)), '[{"a": "b]\\"}"}, {"c": [1]}]')
+        self.assertEqual(stream.consumed, 3)
+        self.assertTrue(stream.closed)
+
+    def test_brackets_inside_strings_are_ignored(self):
+        stream = _FakeStream(['{"items": [{"q": "{[}]\\\\"}', ']}', "tail"])
+        self.assertEqual(_stream_json(_fake_client(stream)), '{"items": [{"q": "{[}]\\\\"}]}')
+
+    def test_returns_full_text_when_no_json(self):
+        stream = _FakeStream(["沒有", " JSON"])
+        self.assertEqual(_stream_json(_fake_client(stream)), "沒有 JSON")
+        self.assertTrue(stream.closed)
+
+
+class _FakeEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def create(self, model, input):
+        self.calls += 1
+        return SimpleNamespace(data=[SimpleNamespace(embedding=self.vectors[input])])
+
+
+class SemanticCacheTests(SimpleTestCase):
+    def setUp(self):
+        clear_cache()
+        self.addCleanup(clear_cache)
+        self.embeddings = _FakeEmbeddings({
+            "原文": [1.0, 0.0],
+            "近似": [0.95, 0.05],
+            "無關": [0.0, 1.0],
+        })
+        self.client = SimpleNamespace(embeddings=self.embeddings)
+        self.model_calls = []
+
+        @semantic_cached(namespace="test", threshold=0.92, ignore=("chunk_index",))
+        def generate(client, text, chunk_index, count=3):
+            self.model_calls.append(text)
+            return [text, count]
+
+        self.generate = generate
+
+    def test_exact_hit_skips_embedding_call(self):
+        self.generate(self.client, "原文", 0)
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(self.generate(self.client, "原文", 0), ["原文", 3])
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(self.model_calls, ["原文"])
+
+    def test_semantic_hit_at_or_above_threshold(self):
+        self.generate(self.client, "原文", 0)
+        self.assertEqual(self.generate(self.client, "近似", 0), ["原文", 3])
+        self.assertEqual(self.model_calls, ["原文"])
+
+    def test_miss_below_threshold_calls_model(self):
+        self.generate(self.client, "原文", 0)
+        self.assertEqual(self.generate(self.client, "無關", 0), ["無關", 3])
+        self.assertEqual(self.model_calls, ["原文", "無關"])
+
+    def test_ignored_params_are_not_part_of_the_key(self):
+        self.generate(self.client, "原文", 0)
+        self.generate(self.client, "原文", 5)
+        self.assertEqual(self.model_calls, ["原文"])
+        # 未列在 ignore 的參數不同則不共用快取（連語意比對也不會命中）
+        self.generate(self.client, "原文", 0, count=4)
+        self.assertEqual(self.model_calls, ["原文", "原文"])
+
+    def test_falsy_results_are_not_cached(self):
+        calls = []
+
+        @semantic_cached(namespace="test-falsy")
+        def failing(client, text):
+            calls.append(text)
+            return []
+
+        failing(self.client, "原文")
+        failing(self.client, "原文")
+        self.assertEqual(calls, ["原文", "原文"])
+
+
+class SubmitBatchTests(SimpleTestCase):
+    def _client(self, status):
+        self.cancelled = []
+        batch = SimpleNamespace(id="batch-1", status=status, output_file_id=None, error_file_id=None)
+        return SimpleNamespace(
+            files=SimpleNamespace(create=lambda file, purpose: SimpleNamespace(id="file-1")),
+            batches=SimpleNamespace(
+                create=lambda **kwargs: batch,
+                retrieve=lambda batch_id: batch,
+                cancel=lambda batch_id: self.cancelled.append(batch_id),
+            ),
+        )
+
+    def test_cancels_and_returns_none_after_max_wait(self):
+        client = self._client("in_progress")
+        requests = [{"custom_id": "summary-0", "body": {}}]
+        self.assertEqual(submit_batch(client, requests, poll_interval=0, max_wait=0), {"summary-0": None})
+        self.assertEqual(self.cancelled, ["batch-1"])
+
+
+def _fake_audio_chunks(count):
+    def _chunks(audio_path):
+        for i in range(count):
+            bio = BytesIO(b"RIFF")
+            bio.name = f"chunk{i}.wav"
+            yield i, bio
+    return _chunks
+
+
+class _FakeTranscriptions:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def create(self, model, file):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            idx = int(file.name[len("chunk"):-len(".wav")])
+            # 較前面的段落較慢完成，確保結果順序不是靠完成順序排出來的
+            await asyncio.sleep(0.001 if idx == self.fail_on else 0.02 - idx * 0.0001)
+            if idx == self.fail_on:
+                raise RuntimeError("whisper 失敗")
+            return SimpleNamespace(text=f"第{idx}段")
+        finally:
+            self.in_flight -= 1
+
+
+class TranscribeChunksAsyncTests(SimpleTestCase):
+    def _run(self, transcriptions, count, concurrency=4):
+        client = SimpleNamespace(audio=SimpleNamespace(transcriptions=transcriptions))
+        with mock.patch("core.ai_modules._prepare_audio_chunks", _fake_audio_chunks(count)):
+            return asyncio.run(_transcribe_chunks_async(client, "lecture.wav", concurrency))
+
+    def test_reassembles_in_chunk_order_with_bounded_concurrency(self):
+        transcriptions = _FakeTranscriptions()
+        pieces = self._run(transcriptions, 20)
+        self.assertEqual([pieces[i] for i in sorted(pieces)], [f"第{i}段" for i in range(20)])
+        self.assertEqual(transcriptions.calls, 20)
+        self.assertLessEqual(transcriptions.peak, 4)
+
+    def test_stops_dispatching_after_first_failure(self):
+        transcriptions = _FakeTranscriptions(fail_on=0)
+        with self.assertRaisesMessage(RuntimeError, "whisper 失敗"):
+            self._run(transcriptions, 100)
+        self.assertEqual(transcriptions.calls, 4)
+
+
+class ParseAndStoreQuestionsTests(SimpleTestCase):
+    def _store(self, quiz_data, question_type):
+        with mock.patch("core.ai_modules.transaction.atomic"), \
+                mock.patch.object(Question.objects, "bulk_create") as bulk_create:
+            parse_and_store_questions("", quiz_data, Lecture(), question_type)
+        if not bulk_create.called:
+            return []
+        return bulk_create.call_args.args[0]
+
+    def test_blank_answer_and_explanation_are_kept(self):
+        objs = self._store([{"question": "是非題", "answer": ""}], "tf")
+        self.assertEqual([(o.question_text, o.correct_answer) for o in objs], [("是非題", "")])
+
+    def test_over_length_fields_skip_only_that_question(self):
+        objs = self._store([
+            {"question": "太長", "answer": "True" * 60},
+            {"question": "正常", "answer": "False"},
+        ], "tf")
+        self.assertEqual([o.question_text for o in objs], ["正常"])
+        objs = self._store([
+            {"question": "選項太長", "options": {"A": "x" * 201, "B": "b", "C": "c", "D": "d"}, "answer": "A"},
+        ], "mcq")
+        self.assertEqual(objs, [])